@@ -1,28 +1,114 @@
 import os
-import threading
+import sys
 import re
+import mmap
+import io
+import codecs
+import locale
+import functools
+import queue
+import threading
+import multiprocessing
+from fnmatch import translate
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 maintain_character_length = True
+replace_character = "*"
+verbose = True
+# Rule flags: ASCII makes \d and \w use the ASCII tables instead of Unicode lookups.
+# This only matters for rules that are not escaped, get_rules() escapes every rule.
+ascii_only = False
+ignore_case = False
+use_fast_regex_engine = True
+
+# Optional regex engines: re2 matches in linear time, regex can release the GIL while matching
+regex_engine = re
+regex_engine_kwargs = {}
+if use_fast_regex_engine:
+    try:
+        import re2 as regex_engine
+    except ImportError:
+        try:
+            import regex as regex_engine
+            regex_engine_kwargs = {"concurrent": True}
+        except ImportError:
+            pass
+
+# Combined regex of all rules, built once by compile_rules()
+combined_rule = None
+combined_rule_kwargs = {}
+rule_groups = {}
+# Files above this size are memory mapped and decoded in chunks
+large_file_size = 1 << 20
+large_file_chunk_size = 1 << 20
+# Automaton of all plain text rules, if pyahocorasick is installed
+literal_automaton = None
+# Otherwise plain text rules, found with str.find
+literal_rules = []
 
 def get_files(source_directory, ignore_list):
     print("Reading files from: " + source_directory)
-    file_list = []
-
-    for root, dirs, files in os.walk(source_directory):
-        for file in files:
-            file_path = os.path.join(root, file)
-            file_list.append(file_path)
+    file_list = list(walk_files(source_directory))
             
-    # Remove files in ignore list
-    for ignore in ignore_list:
-        ignore = ignore.strip()
-        for file in file_list:
-            if file.endswith(ignore):
-                file_list.remove(file)
-                print("File ignored:", file)
+    # Remove files in ignore list in a single pass, plain entries need no regex
+    suffixes, ignore_rule = get_ignore_rules(ignore_list)
+    kept_files = []
+    for file in file_list:
+        if file.endswith(suffixes) or (ignore_rule is not None and ignore_rule.match(file)):
+            print("File ignored:", file)
+        else:
+            kept_files.append(file)
+    file_list = kept_files
                 
     return file_list
 
+def walk_files(directory):
+    # DirEntry caches the file type from the directory listing, so no extra stat per file.
+    # Missing or unreadable directories are skipped, as os.walk did.
+    try:
+        entries = os.scandir(directory)
+    except OSError as error:
+        print("Directory skipped:", directory, "\n    Error:", error)
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(entry.path)
+            elif entry.is_file():
+                yield entry.path
+
+def get_ignore_rules(ignore_list):
+    # Entries match the end of the file path and may use glob wildcards.
+    # Plain entries and pure suffix globs such as "*.xel" are returned as a tuple for
+    # str.endswith, only the remaining globs need the regex.
+    suffixes = []
+    patterns = []
+    for ignore in ignore_list:
+        ignore = ignore.strip()
+        if ignore == "":
+            continue
+        suffix = ignore.lstrip("*")
+        if any(char in suffix for char in "*?["):
+            patterns.append(translate("*" + suffix))
+        else:
+            suffixes.append(suffix)
+
+    ignore_rule = None
+    if patterns:
+        ignore_rule = re.compile("|".join(patterns))
+    return tuple(suffixes), ignore_rule
+
 def get_ignore_list():
     ignore_list = []
     ignore_file = os.path.join(os.getcwd(), 'ignore.list')
@@ -35,84 +121,321 @@ def get_ignore_list():
 def get_rules():
     print("Reading rules from: " + os.path.join(os.getcwd(), 'main.rule'))
     rules_file = os.path.join(os.getcwd(), 'main.rule')
-    rules = []
     with open(rules_file, 'r') as file:
-        rules = file.readlines()
+        lines = file.readlines()
         
-    for rule in rules:
-        if rule.startswith("#"):
-            rules.remove(rule)
-            
+    # Skip comments and empty lines
+    rules = [line.strip() for line in lines if line.strip() and not line.startswith("#")]
             
     print("Rules to be applied:")
     for rule in rules:
         print("      - " + rule)
         
-    # Return rules string as regex
-    regex_rules = []
-    for i in range(len(rules)):
-        rule = rules[i].strip()
-        regex_rule = re.escape(rule)  # Convert rule to regex expression
-        regex_rules.append(regex_rule)
-    
-    return regex_rules
+    # Return rules string as regex, compile_rules() compiles them once for all files
+    return [re.escape(rule) for rule in rules]
 
-def process_file(file, result_directory, rules):
-    result_list = []
+def process_file(file, result_directory):
+    # Errors are reported per file, so one bad file does not stop the others
+    try:
+        return sanitise_file(file, result_directory)
+    except Exception as error:
+        print("Error processing file:", file, "\n    Error:", repr(error))
+        return None
+
+def sanitise_file(file, result_directory):
     if file.endswith('.xel'):
         return None
     
-    with open(file, 'r') as f:
-        lines = f.readlines()
-        
-    for line in lines:
-        for rule in rules:
-            #print("Checking for rule:", rule, "in line:", line)
-            if re.search(rule, line):
-                # Modify the line, so the rule is not present
-                print("Rule found in file:", file.split('\\')[-1], "\n    Rule:", rule, "\n    Line:", line)
-                line = line.replace(rule, get_replace_str(rule))
-                print("Line modified:", line)
-        result_list.append(line)
-    
-    # Write the modified content to a new file in the results directory
-    with open(os.path.join(result_directory, os.path.basename(file)), 'w') as file:
-        file.writelines(result_list)
+    result_file = os.path.join(result_directory, os.path.basename(file))
+    if os.path.getsize(file) > large_file_size:
+        process_large_file(file, result_file)
+        print("File processed:", result_file)
+        return None
+
+    # Small files are sanitised in memory and handed back to the writer thread
+    result = []
+    with open(file, 'r', buffering=1<<20) as f:
+        for line in f:
+            # Modify the line, so no rule is present. Rules are only tracked for the output when verbose.
+            found_rules = [] if verbose else None
+            new_line = sanitise(line, found_rules)
+
+            if found_rules:
+                for rule in found_rules:
+                    print("Rule found in file:", file.split('\\')[-1], "\n    Rule:", rule, "\n    Line:", line)
+                print("Line modified:", new_line)
+            result.append(new_line)
         
-    print("File processed:", file.name)
+    return result_file, "".join(result)
+
+def write_results(result_queue):
+    # Write the sanitised files while the workers process the next ones.
+    # Errors are reported per file, so one bad destination does not stop the others.
+    while True:
+        item = result_queue.get()
+        if item is None:
+            break
+        result_file, content = item
+        temp_file = result_file + ".tmp"
+        try:
+            with open(temp_file, 'w', buffering=1<<20) as result:
+                result.write(content)
+            os.replace(temp_file, result_file)
+            print("File processed:", result_file)
+        except Exception as error:
+            # Leave no partial result behind
+            if os.path.isfile(temp_file):
+                os.remove(temp_file)
+            print("Error processing file:", result_file, "\n    Error:", repr(error))
+
+def process_large_file(file, result_file):
+    # Decode the memory mapped file one chunk at a time, with the same encoding and newline
+    # handling as open(), so large files are sanitised line by line exactly like small ones
+    found_rules = {}
+    encoding = locale.getpreferredencoding(False)
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), translate=True)
+    temp_file = result_file + ".tmp"
+    try:
+        with open(file, 'rb') as f, open(temp_file, 'w', buffering=1<<20) as result:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pending = ""
+                for pos in range(0, len(mm), large_file_chunk_size):
+                    pending += decoder.decode(mm[pos:pos + large_file_chunk_size])
+                    lines = pending.split("\n")
+                    pending = lines.pop()
+                    for line in lines:
+                        result.write(sanitise_counted(line + "\n", found_rules))
+                pending += decoder.decode(b"", final=True)
+                if pending:
+                    result.write(sanitise_counted(pending, found_rules))
+    except BaseException:
+        # Leave no partial result behind
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    os.replace(temp_file, result_file)
+
+    for rule, count in found_rules.items():
+        print("Rule found in file:", file.split('\\')[-1], "\n    Rule:", rule, "\n    Matches:", count)
+
+def sanitise_counted(line, found_rules):
+    # Large files report a count per rule instead of every line
+    line_rules = [] if verbose else None
+    line = sanitise(line, line_rules)
+    if line_rules:
+        for rule in line_rules:
+            found_rules[rule] = found_rules.get(rule, 0) + 1
+    return line
+
+def sanitise(line, found_rules):
+    # Plain text rules first, then everything else in one pass of the combined rule
+    if literal_automaton is not None or literal_rules:
+        line = replace_literals(line, found_rules)
+    if combined_rule is not None:
+        line = replace_rules(line, found_rules)
+    return line
+
+def replace_literals(line, found_rules):
+    # Every hit of a plain text rule is masked and overlapping hits are merged into one span,
+    # so "abc" and "bcd" turn "abcd" into "****". The automaton and the str.find fallback find
+    # the same hits, so the output does not depend on pyahocorasick being installed.
+    spans = []
+    if literal_automaton is not None:
+        # One automaton pass finds every plain text rule
+        for end_index, (rule, literal) in literal_automaton.iter(line):
+            spans.append((end_index - len(literal) + 1, end_index + 1, rule))
+    else:
+        for rule, literal in literal_rules:
+            start = line.find(literal)
+            while start != -1:
+                spans.append((start, start + len(literal), rule))
+                start = line.find(literal, start + 1)
+    if not spans:
+        return line
+
+    spans.sort()
+    result = []
+    pos = 0
+    for start, end, rule in spans:
+        if found_rules is not None:
+            found_rules.append(rule)
+        if end <= pos:
+            continue
+        start = max(start, pos)
+        result.append(line[pos:start])
+        if maintain_character_length:
+            result.append(get_replace_length(end - start))
+        pos = end
+    result.append(line[pos:])
+    return "".join(result)
+
+def replace_rules(line, found_rules):
+    if not maintain_character_length and found_rules is None:
+        # Fixed replacement and nothing to track, so sub runs without a Python callback per match
+        return combined_rule.sub("", line, **combined_rule_kwargs)
+
+    # Collect the matches in a single pass and rebuild the line from slices of the original,
+    # lines without a match are returned as they are
+    result = []
+    pos = 0
+    for match in combined_rule.finditer(line, **combined_rule_kwargs):
+        start, end = match.span()
+        result.append(line[pos:start])
+        if maintain_character_length:
+            result.append(get_replace_length(end - start))
+        pos = end
+        if found_rules is not None:
+            found_rules.append(rule_groups[match.lastindex])
+    if not result:
+        return line
+    result.append(line[pos:])
+    return "".join(result)
+
+def get_literal(rule):
+    # Return the plain text matched by a rule without any regex syntax, otherwise None
+    try:
+        parsed = sre_parse.parse(rule)
+    except re.error:
+        return None
+
+    literal = ""
+    for op, value in parsed:
+        if op != sre_parse.LITERAL:
+            return None
+        literal += chr(value)
+    return literal
+
+def compile_rules(rules):
+    global combined_rule, combined_rule_kwargs, rule_groups, literal_automaton
+    global literal_rules
+    # Plain text rules go into one Aho-Corasick automaton when pyahocorasick is available,
+    # otherwise they are found with str.find without going through the regex engine
+    literal_rules = []
+    automaton = None
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+
+    # Join all other rules into one alternation, so every line is scanned only once.
+    # Each rule is wrapped in its own group, match.lastindex tells which rule matched.
+    patterns = []
+    rule_groups = {}
+    group_index = 1
+    for rule in rules:
+        if rule == "":
+            continue
+        rule_group_count = re.compile(rule).groups + 1
+
+        # Plain text fast paths are case sensitive
+        literal = None if ignore_case else get_literal(rule)
+        if literal:
+            if automaton is not None:
+                automaton.add_word(literal, (rule, literal))
+            else:
+                literal_rules.append((rule, literal))
+            continue
+        patterns.append("(" + rule + ")")
+        rule_groups[group_index] = rule
+        group_index += rule_group_count
+
+    combined_rule = None
+    combined_rule_kwargs = {}
+    if patterns:
+        pattern = "|".join(patterns)
+        try:
+            combined_rule = regex_engine.compile(pattern, get_rule_flags(regex_engine))
+            combined_rule_kwargs = regex_engine_kwargs
+        except (regex_engine.error, AttributeError, TypeError):
+            # Rule uses syntax or flags the optional engine does not support
+            print("Falling back to re for rules")
+            combined_rule = re.compile(pattern, get_rule_flags(re))
+
+    literal_automaton = None
+    if automaton is not None and len(automaton) > 0:
+        automaton.make_automaton()
+        literal_automaton = automaton
+
+def get_rule_flags(engine):
+    # Flag values differ between regex engines, so they are taken from the engine itself.
+    # google-re2 takes an Options object instead, its \d and \w are always ASCII.
+    if hasattr(engine, 'Options'):
+        options = engine.Options()
+        options.case_sensitive = not ignore_case
+        return options
+
+    flags = 0
+    # ASCII with IGNORECASE only folds ASCII letters, so rules like "JOSÉ" would miss "José"
+    if ascii_only and not ignore_case:
+        flags |= engine.ASCII
+    if ignore_case:
+        flags |= engine.IGNORECASE
+    return flags
 
 def process_files(files, result_directory, rules):
-    threads = []
-    for file in files:
-        if file != None:
-            thread = threading.Thread(target=process_file, args=(file,result_directory,rules,))
-            thread.name = file + " Thread"
-            thread.start()
-            threads.append(thread)
-
-    # Wait for all threads to finish
-    for thread in threads:
-        thread.join()
-  
-    # Call the function to check and modify file names
-    check_file_names(result_directory, rules)
-
-def check_file_names(result_directory, rules):
+    files = [file for file in files if file != None]
+    compile_rules(rules)
+
+    try:
+        sanitise_files(files, result_directory, rules)
+    finally:
+        # Call the function to check and modify file names, also when processing failed,
+        # so no rule is left in a result file name
+        check_file_names(result_directory)
+
+def sanitise_files(files, result_directory, rules):
+    if combined_rule is not None and combined_rule_kwargs and literal_automaton is None and not literal_rules:
+        # Every rule runs in the regex engine, which releases the GIL while matching,
+        # so a bounded pool of threads sharing one compiled rule is enough
+        executor = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4))
+    elif sys.platform.startswith('linux'):
+        # Regex matching holds the GIL, so spread the files over one process per core.
+        # Forked workers share the rules compiled above, nothing is pickled or compiled again.
+        executor = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context('fork'))
+    else:
+        # Spawned workers start from a fresh import and compile the rules once at startup
+        executor = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=compile_rules, initargs=(rules,))
+
+    # One writer thread drains the results, so writing overlaps with the regex work
+    result_queue = queue.Queue(maxsize=64)
+    writer = None
+    try:
+        with executor:
+            for item in executor.map(process_file, files, repeat(result_directory), chunksize=8):
+                if item is None:
+                    continue
+                if writer is None:
+                    # Started with the first result, so it is never running while the workers are forked
+                    writer = threading.Thread(target=write_results, args=(result_queue,))
+                    writer.name = "Writer Thread"
+                    writer.start()
+                result_queue.put(item)
+    finally:
+        if writer is not None:
+            result_queue.put(None)
+            writer.join()
+
+def check_file_names(result_directory):
     for file_name in os.listdir(result_directory):
-        for rule in rules:
-            if rule in file_name:
-                # Modify the file name, so the rule is not present
-                new_file_name = file_name.replace(rule, get_replace_str(rule))
-                old_file_path = os.path.join(result_directory, file_name)
-                new_file_path = os.path.join(result_directory, new_file_name)
-                os.rename(old_file_path, new_file_path)
-                print("File name modified:", file_name, "->", new_file_name)
+        # Modify the file name with the compiled rules, so no rule is present
+        new_file_name = sanitise(file_name, None)
+
+        if new_file_name != file_name:
+            old_file_path = os.path.join(result_directory, file_name)
+            new_file_path = os.path.join(result_directory, new_file_name)
+            os.rename(old_file_path, new_file_path)
+            print("File name modified:", file_name, "->", new_file_name)
 
 def get_replace_str(rule):
     if maintain_character_length:
-        return "*" * len(rule)
+        return get_replace_length(len(rule))
     else:
         return ""
+
+# Matches tend to repeat the same few lengths, so the replacement strings are cached
+@functools.lru_cache(maxsize=1024)
+def get_replace_length(length):
+    repetitions, remainder = divmod(length, len(replace_character))
+    return replace_character * repetitions + replace_character[:remainder]
         
 
 def __main__():
@@ -127,5 +450,6 @@ def __main__():
     
     # Call the function to process the files
     process_files(file_list, results_directory, rules)
-        
-__main__()
+
+if __name__ == '__main__':
+    __main__()